@@ -5,121 +5,327 @@ make_charts.py — Auto‑detect Elliott Waves & generate interactive chart for
 • Row 2  成交量柱狀圖（紅漲綠跌）
 • Row 3  KD(9)
 
-產生單一 `0050_charts.html`，並在圖表標題顯示 **資料生成時間（台灣）**，方便辨識最新度。
+同一次執行（只下載、計算一次）輸出三個檔案：
+• `0050_charts.html`       上述三列合併圖，標題顯示 **資料生成時間（台灣）**，方便辨識最新度
+• `0050_candlestick.html`  K 線 + MA + 布林通道
+• `0050_kd.html`           KD 指標
 """
 
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+import math
+from pathlib import Path
 from zoneinfo import ZoneInfo
-from plotly.subplots import make_subplots
-import plotly.graph_objects as go
+from numpy.lib.stride_tricks import sliding_window_view
+import bottleneck as bn
+import numpy as np
 import pandas as pd
-import yfinance as yf
+
+# plotly / yfinance 匯入成本高（數百 ms），改在用到的函式內才 import；
+# 只 import 本模組做指標計算時不需付出這筆成本
 
 # ---------------- 參數 ----------------
 TICKER = "0050.TW"
 PERIOD  = "70d"              # 近 70 天足以計算 20 日布林
 WINDOW  = 4                  # pivot window 大小 (Elliott wave 簡易偵測)
 THRESH  = 0.02               # 2% 高低差視為 pivot
+MAX_POINTS = 800            # 線圖最多輸出點數（約等於圖寬像素），超過以 LTTB 降採樣
+CACHE_DIR = Path(".cache")   # 當日下載結果快取，同日重跑免再連 Yahoo
+COLUMNS = ["Date", "Open", "High", "Low", "Close", "Volume"]   # 只保留用得到的欄位
 
 # -------------- 抓取資料 --------------
-print("Downloading historical data…")
-df = yf.Ticker(TICKER).history(period=PERIOD).reset_index()
+def _cache_path(ticker, period):
+    return CACHE_DIR / f"{ticker}_{period}_{date.today()}.pkl"
+
+def fetch(tickers, period):
+    """批次抓取多檔歷史資料，回傳 {ticker: DataFrame}。
+
+    已有當日快取者直接讀檔；其餘以單次 `yf.download` 合併下載（Yahoo 單批上限約 20 檔），
+    再依 ticker 拆回各自的 DataFrame（只留 COLUMNS）並寫入快取。
+    """
+    frames = {}
+    missing = []
+    for t in tickers:
+        path = _cache_path(t, period)
+        if path.exists():
+            print(f"Loading cached data ({path})…")
+            frames[t] = pd.read_pickle(path)
+        else:
+            missing.append(t)
+
+    if missing:
+        import yfinance as yf           # 全部命中快取時就不必 import
+
+        print(f"Downloading historical data ({' '.join(missing)})…")
+        # auto_adjust 預設值隨 yfinance 版本改變過；明確指定以維持 Ticker.history 的還原權息價
+        raw = yf.download(missing, period=period, group_by="ticker", auto_adjust=True,
+                          threads=True, progress=False)
+        CACHE_DIR.mkdir(exist_ok=True)
+        for t in missing:
+            data = raw[t] if isinstance(raw.columns, pd.MultiIndex) else raw
+            data = data.dropna(how="all").reset_index()[COLUMNS]
+            # yf.download 失敗時不會丟例外，只回傳空表或全 NaN 欄；不可寫進當日快取
+            if data.empty:
+                raise RuntimeError(f"No data downloaded for {t} (period={period})")
+            data.to_pickle(_cache_path(t, period))
+            frames[t] = data
+    return frames
+
+def load_history(ticker, period):
+    """單檔版 `fetch`。"""
+    return fetch([ticker], period)[ticker]
 
 # ------------- 技術指標計算 -------------
-for n in (5, 14, 20):
-    df[f"MA_{n}"] = df["Close"].rolling(n).mean()
+def ewm_alpha(x, alpha):
+    """等同 `pd.Series(x).ewm(alpha=alpha, adjust=False).mean()`：y[i] = α·x[i] + (1-α)·y[i-1]。
 
-df["BB_Mid"] = df["MA_20"]
-df["BB_Std"] = df["Close"].rolling(20).std(ddof=0)
-df["BB_Upper"] = df["BB_Mid"] + 2 * df["BB_Std"]
-df["BB_Lower"] = df["BB_Mid"] - 2 * df["BB_Std"]
+    開頭的 NaN（暖身期）保持 NaN，遞迴自第一個有效值起算；中途的 NaN 輸出前值，
+    且與 pandas（ignore_na=False）相同，前值權重在缺值期間照樣逐期乘上 (1-α)。
+    """
+    y = np.full(len(x), np.nan)
+    prev = np.nan
+    old_wt = 1.0
+    for i, v in enumerate(x.tolist()):
+        if math.isnan(prev):
+            prev = v
+        else:
+            old_wt *= 1 - alpha
+            if not math.isnan(v):
+                prev = (old_wt * prev + alpha * v) / (old_wt + alpha)
+                old_wt = 1.0
+        y[i] = prev
+    return y
 
-low_min  = df["Low"].rolling(9).min()
-high_max = df["High"].rolling(9).max()
-df["RSV"] = (df["Close"] - low_min) / (high_max - low_min) * 100
-df["K"]   = df["RSV"].ewm(alpha=1/3, adjust=False).mean()
-df["D"]   = df["K"].ewm(alpha=1/3, adjust=False).mean()
+def compute_indicators(df):
+    """加上 MA 5/14/20、20 日布林通道與 KD(9) 欄位。
+
+    指標先收集在 dict，最後以單次 `pd.concat` 併回，避免逐欄插入造成 DataFrame 碎片化。
+    """
+    close = df["Close"].to_numpy(dtype=np.float64)
+    high  = df["High"].to_numpy(dtype=np.float64)
+    low   = df["Low"].to_numpy(dtype=np.float64)
+
+    # 一次累積和即可得出所有 MA：MA_n[i] = (csum[i+1] - csum[i+1-n]) / n
+    # 與 rolling(n).mean() 相同，視窗內有任何 NaN 即為 NaN（另累計有效筆數判斷），
+    # 避免單一缺值讓之後所有 MA 都變 NaN
+    csum = np.concatenate(([0.0], np.nancumsum(close)))
+    nobs = np.concatenate(([0], np.cumsum(~np.isnan(close))))
+    ind = {}
+    for n in (5, 14, 20):
+        ma = np.full_like(close, np.nan)
+        full = (nobs[n:] - nobs[:-n]) == n
+        ma[n - 1:] = np.where(full, (csum[n:] - csum[:-n]) / n, np.nan)
+        ind[f"MA_{n}"] = ma
+
+    # 布林中線即 MA_20，只需再做一次 rolling std；標準差不另存欄位
+    bb_std = pd.Series(close).rolling(20).std(ddof=0).to_numpy()
+    ind["BB_Mid"]   = ind["MA_20"]
+    ind["BB_Upper"] = ind["MA_20"] + 2 * bb_std
+    ind["BB_Lower"] = ind["MA_20"] - 2 * bb_std
+
+    low_min  = bn.move_min(low, window=9)
+    high_max = bn.move_max(high, window=9)
+    rsv = (close - low_min) / (high_max - low_min) * 100
+    ind["RSV"] = rsv
+    ind["K"]   = ewm_alpha(rsv, 1/3)
+    ind["D"]   = ewm_alpha(ind["K"], 1/3)
+    return pd.concat([df, pd.DataFrame(ind, index=df.index)], axis=1)
 
 # --------- 簡易 Elliott Wave 偵測 ---------
-# 使用 pivot 擷取轉折點
-pivots = []
-for i in range(WINDOW, len(df) - WINDOW):
-    window = df.iloc[i - WINDOW:i + WINDOW + 1]
-    price  = df.loc[i, "Close"]
-    if price == window["Close"].max():
-        pivots.append((i, price, "peak"))
-    elif price == window["Close"].min():
-        pivots.append((i, price, "trough"))
-
-# 依序挑出 5+3 浪（啟發式：交替 peak/trough，價差 > THRESH）
-waves = []
-for idx, price, kind in pivots:
-    if not waves:
-        waves.append((idx, price))
-    else:
-        prev_idx, prev_price = waves[-1]
-        if kind == ("peak" if price > prev_price else "trough") and abs(price - prev_price) / prev_price > THRESH:
+def pivot_points(series, window):
+    """回傳 (peak 索引, trough 索引)：中心點為前後 `window` 根內的最高 / 最低價。"""
+    arr = series.to_numpy()
+    if len(arr) < 2 * window + 1:        # 資料不足一個視窗：沒有 pivot
+        empty = np.array([], dtype=np.intp)
+        return empty, empty
+    win = sliding_window_view(arr, 2 * window + 1)
+    center = arr[window:-window]
+    # 與 Series.max()/min() 相同跳過 NaN；中心點為 NaN 時比較結果為 False，不會成為 pivot
+    is_high = center == np.nanmax(win, axis=1)
+    is_low  = (center == np.nanmin(win, axis=1)) & ~is_high   # 平盤時視為 peak
+    return np.flatnonzero(is_high) + window, np.flatnonzero(is_low) + window
+
+def detect_waves(df):
+    """回傳 (wave_pts, forecast)：wave_pts 為 {標籤: (索引, 價格)}，forecast 為 C 浪預測線 (x, y) 或 None。"""
+    closes = df["Close"].to_numpy()
+    dates  = df["Date"].array            # 取值為 pd.Timestamp（yf.download 日線為無時區日期）
+
+    # 使用 pivot 擷取轉折點
+    hi_idx, lo_idx = pivot_points(df["Close"], WINDOW)
+    pivots = sorted([(i, closes[i], "peak") for i in hi_idx] +
+                    [(i, closes[i], "trough") for i in lo_idx])
+
+    # 依序挑出 5+3 浪（啟發式：交替 peak/trough，價差 > THRESH）
+    # 每個候選點都要和「上一個已選浪點」比較，無法以 np.diff 向量化；改為只保留前一浪價格
+    waves = []
+    prev_price = None
+    for idx, price, kind in pivots:
+        if prev_price is None or (kind == ("peak" if price > prev_price else "trough")
+                                  and abs(price - prev_price) / prev_price > THRESH):
             waves.append((idx, price))
-    if len(waves) == 8:  # 0‑5 + A‑C 共 8 個點
-        break
-
-labels = ["0","1","2","3","4","5","A","B","C"]
-wave_pts = dict(zip(labels[:len(waves)], waves))
-
-# ---- 依 B 浪 → C 浪 預測 (0.382 & 0.618) ----
-forecast_x = []
-forecast_y = []
-if "B" in wave_pts and "A" in wave_pts:
-    b_idx, b_price = wave_pts["B"]
-    a_idx, a_price = wave_pts["A"]
-    direction = 1 if b_price > a_price else -1
-    c_target = b_price + direction * abs(b_price - a_price) * 0.618
-    last_date = df.loc[b_idx, "Date"]
-    forecast_date = last_date + pd.Timedelta(days=25)
-    forecast_x = [df.loc[b_idx, "Date"], forecast_date]
-    forecast_y = [b_price, c_target]
+            prev_price = price
+            if len(waves) == 8:  # 0‑5 + A‑C 共 8 個點
+                break
+
+    labels = ["0","1","2","3","4","5","A","B","C"]
+    wave_pts = dict(zip(labels[:len(waves)], waves))
+
+    # ---- 依 B 浪 → C 浪 預測 (0.382 & 0.618) ----
+    forecast = None
+    if "B" in wave_pts and "A" in wave_pts:
+        b_idx, b_price = wave_pts["B"]
+        a_idx, a_price = wave_pts["A"]
+        direction = 1 if b_price > a_price else -1
+        c_target = b_price + direction * abs(b_price - a_price) * 0.618
+        last_date = dates[b_idx]
+        forecast_date = last_date + pd.Timedelta(days=25)
+        forecast = ([last_date, forecast_date], [b_price, c_target])
+    return wave_pts, forecast
+
+# ------------- 降採樣 (LTTB) -------------
+def lttb_indices(y, n_out):
+    """Largest-Triangle-Three-Buckets：回傳保留點的索引（x 以交易日序號計）。"""
+    size = len(y)
+    if n_out >= size or n_out < 3:
+        return np.arange(size)
+    x = np.arange(size, dtype=float)
+    buckets = np.array_split(np.arange(1, size - 1), n_out - 2)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, size - 1
+    a = 0
+    for k, bucket in enumerate(buckets):
+        nxt = buckets[k + 1] if k + 1 < len(buckets) else np.array([size - 1])
+        cx, cy = x[nxt].mean(), y[nxt].mean()
+        area = np.abs((x[a] - cx) * (y[bucket] - y[a]) - (x[a] - x[bucket]) * (cy - y[a]))
+        a = bucket[area.argmax()]
+        out[k + 1] = a
+    return out
+
+def line_xy(df, col):
+    """取 df[col] 的 x / y（trace kwargs），去掉開頭暖身期 NaN 並降採樣至約 MAX_POINTS 點。
+
+    中途的 NaN 保留為斷點（與原本 go.Scatter 相同，不跨缺值連線）；LTTB 不接受 NaN，
+    因此超過 MAX_POINTS 時依斷點切成連續有效段，各段按長度分配點數後分別降採樣。
+    """
+    x = df["Date"].to_numpy()
+    y = df[col].to_numpy()
+    valid = ~np.isnan(y)
+    start = valid.argmax() if valid.any() else len(y)
+    x, y, valid = x[start:], y[start:], valid[start:]
+    if len(y) <= MAX_POINTS:
+        return dict(x=x, y=y)
+
+    # 有效段 [a, b)：valid 由 False→True 與 True→False 的位置
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], valid.astype(np.int8), [0]))))
+    n_valid = valid.sum()
+    idx = []
+    for a, b in zip(edges[::2], edges[1::2]):
+        idx.append(a + lttb_indices(y[a:b], max(3, round(MAX_POINTS * (b - a) / n_valid))))
+        if b < len(y):
+            idx.append(np.array([b]))     # 保留一個 NaN 作為斷點
+    idx = np.concatenate(idx)
+    return dict(x=x[idx], y=y[idx])
 
 # ------------- 畫圖 -------------
-fig = make_subplots(rows=3, cols=1, shared_xaxes=True,
-                    vertical_spacing=0.02, row_heights=[0.55, 0.25, 0.20])
-
-# Row1: Candlestick
-inc = df["Close"] >= df["Open"]
-dec = ~inc
-fig.add_trace(go.Candlestick(x=df["Date"], open=df["Open"], high=df["High"],
-                             low=df["Low"], close=df["Close"],
-                             increasing_line_color="red", decreasing_line_color="green", name="OHLC"),
-              row=1, col=1)
-
-for n,col in ((5,"orange"),(14,"blue"),(20,"purple")):
-    fig.add_trace(go.Scatter(x=df["Date"], y=df[f"MA_{n}"], name=f"MA{n}", line=dict(color=col)), row=1, col=1)
-
-fig.add_trace(go.Scatter(x=df["Date"], y=df["BB_Upper"], name="Boll Upper", line=dict(color="gray", dash="dash")), row=1, col=1)
-fig.add_trace(go.Scatter(x=df["Date"], y=df["BB_Mid"],   name="Boll Mid",   line=dict(color="gray", dash="dot")),  row=1, col=1)
-fig.add_trace(go.Scatter(x=df["Date"], y=df["BB_Lower"], name="Boll Lower", line=dict(color="gray", dash="dash")), row=1, col=1)
-
-# Wave annotations
-for lbl,(i,price) in wave_pts.items():
-    fig.add_annotation(x=df.loc[i,"Date"], y=price, text=lbl, showarrow=True, arrowhead=1, row=1, col=1)
-
-# Forecast line
-if forecast_x:
-    fig.add_trace(go.Scatter(x=forecast_x, y=forecast_y, mode="lines", name="Forecast", line=dict(color="dodgerblue", dash="dash")), row=1, col=1)
-
-# Row2: Volume
-fig.add_trace(go.Bar(x=df["Date"], y=df["Volume"], marker_color=["red" if inc[i] else "green" for i in range(len(df))], name="Volume"), row=2, col=1)
-
-# Row3: KD
-fig.add_trace(go.Scatter(x=df["Date"], y=df["K"], name="%K", line=dict(color="gold")), row=3, col=1)
-fig.add_trace(go.Scatter(x=df["Date"], y=df["D"], name="%D", line=dict(color="darkorange")), row=3, col=1)
-fig.add_hline(y=80, line_dash="dash", row=3, col=1)
-fig.add_hline(y=20, line_dash="dash", row=3, col=1)
-
-# 生成時間 (台灣)
-now_tw = datetime.now(ZoneInfo("Asia/Taipei")).strftime("%Y-%m-%d %H:%M %Z")
-fig.update_layout(title=f"0050 ETF 技術圖表  (生成時間：{now_tw})",
-                  xaxis_rangeslider_visible=False, legend_orientation="h", legend_y=1.03)
-
-print("Writing HTML…")
-fig.write_html("0050_charts.html", include_plotlyjs="cdn")
-print("✔  Done. 0050_charts.html generated.")
+def add_price_traces(fig, df, **rc):
+    """K 線 + MA + 布林通道；`rc` 為子圖位置 (row=, col=)。"""
+    import plotly.graph_objects as go
+
+    fig.add_trace(go.Candlestick(x=df["Date"], open=df["Open"], high=df["High"],
+                                 low=df["Low"], close=df["Close"],
+                                 increasing_line_color="red", decreasing_line_color="green", name="OHLC"),
+                  **rc)
+
+    for n,col in ((5,"orange"),(14,"blue"),(20,"purple")):
+        fig.add_trace(go.Scattergl(**line_xy(df, f"MA_{n}"), name=f"MA{n}", line=dict(color=col)), **rc)
+
+    fig.add_trace(go.Scattergl(**line_xy(df, "BB_Upper"), name="Boll Upper", line=dict(color="gray", dash="dash")), **rc)
+    fig.add_trace(go.Scattergl(**line_xy(df, "BB_Mid"),   name="Boll Mid",   line=dict(color="gray", dash="dot")),  **rc)
+    fig.add_trace(go.Scattergl(**line_xy(df, "BB_Lower"), name="Boll Lower", line=dict(color="gray", dash="dash")), **rc)
+
+def add_kd_traces(fig, df, **rc):
+    """%K / %D 與 80、20 參考線。"""
+    import plotly.graph_objects as go
+
+    fig.add_trace(go.Scattergl(**line_xy(df, "K"), name="%K", line=dict(color="gold")), **rc)
+    fig.add_trace(go.Scattergl(**line_xy(df, "D"), name="%D", line=dict(color="darkorange")), **rc)
+    fig.add_hline(y=80, line_dash="dash", **rc)
+    fig.add_hline(y=20, line_dash="dash", **rc)
+
+def build_combined_fig(df, labels=None, forecast=None):
+    """三列合併圖；labels 為 `detect_waves` 的 wave_pts，forecast 為 (x, y)。"""
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    fig = make_subplots(rows=3, cols=1, shared_xaxes=True,
+                        vertical_spacing=0.02, row_heights=[0.55, 0.25, 0.20])
+
+    # Row1: Candlestick
+    add_price_traces(fig, df, row=1, col=1)
+
+    # Wave annotations
+    dates = df["Date"].array
+    for lbl,(i,price) in (labels or {}).items():
+        fig.add_annotation(x=dates[i], y=price, text=lbl, showarrow=True, arrowhead=1, row=1, col=1)
+
+    # Forecast line
+    if forecast:
+        forecast_x, forecast_y = forecast
+        fig.add_trace(go.Scattergl(x=forecast_x, y=forecast_y, mode="lines", name="Forecast", line=dict(color="dodgerblue", dash="dash")), row=1, col=1)
+
+    # Row2: Volume
+    inc = df["Close"].to_numpy() >= df["Open"].to_numpy()
+    fig.add_trace(go.Bar(x=df["Date"], y=df["Volume"], marker_color=np.where(inc, "red", "green"), name="Volume"), row=2, col=1)
+
+    # Row3: KD
+    add_kd_traces(fig, df, row=3, col=1)
+
+    # 生成時間 (台灣)
+    now_tw = datetime.now(ZoneInfo("Asia/Taipei")).strftime("%Y-%m-%d %H:%M %Z")
+    fig.update_layout(title=f"0050 ETF 技術圖表  (生成時間：{now_tw})",
+                      xaxis_rangeslider_visible=False, legend_orientation="h", legend_y=1.03)
+    return fig
+
+def build_candlestick_only(df):
+    import plotly.graph_objects as go
+
+    fig = go.Figure()
+    add_price_traces(fig, df)
+    fig.update_layout(title="0050 ETF — K 線 + 布林通道", xaxis_title="Date", yaxis_title="Price (TWD)",
+                      xaxis_rangeslider_visible=False)
+    return fig
+
+def build_kd_only(df):
+    import plotly.graph_objects as go
+
+    fig = go.Figure()
+    add_kd_traces(fig, df)
+    fig.update_layout(title="KD 指標", xaxis_title="Date", yaxis_title="Value")
+    return fig
+
+# ------------- 主程式 -------------
+def main():
+    import plotly.io as pio
+    from plotly.offline import get_plotlyjs
+
+    df = compute_indicators(load_history(TICKER, PERIOD))
+    wave_pts, forecast = detect_waves(df)
+
+    outputs = {
+        "0050_charts.html":      build_combined_fig(df, wave_pts, forecast),
+        "0050_candlestick.html": build_candlestick_only(df),
+        "0050_kd.html":          build_kd_only(df),
+    }
+
+    # 三個頁面共用同目錄下的一份 plotly.min.js（離線可用，瀏覽器只需載入一次）。
+    # plotly 僅在檔案不存在時寫出：先由主執行緒寫好（跟上已安裝的 plotly 版本），
+    # 平行寫 HTML 時各執行緒就不會同時寫這個檔
+    Path("plotly.min.js").write_text(get_plotlyjs(), encoding="utf-8")
+    print("Writing HTML…")
+    with ThreadPoolExecutor(max_workers=len(outputs)) as pool:
+        list(pool.map(lambda item: pio.write_html(item[1], file=item[0], include_plotlyjs="directory", validate=False),
+                      outputs.items()))
+    print(f"✔  Done. {', '.join(outputs)} generated.")
+
+if __name__ == "__main__":
+    main()